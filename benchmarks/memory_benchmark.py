@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the memory held by resolved variables of a whole service and environment matrix,
+resolved one combination at a time with ExconfConfig.resolve_variables, and all at once with
+compact.MatrixResolver. Generates a synthetic configuration root for the measurement.
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+from exconf import compact, config
+from testutils import make_config_root, write_yaml
+
+
+def generate_config_root(services, environments, global_vars, env_vars, service_vars):
+    config_root = make_config_root(copy_templates=True)
+    envs_dir = os.path.join(config_root, 'environments')
+    globals_data = {'global_{}'.format(i): 'global value {} in ${{{{ environment }}}} '
+                    'for ${{{{ global_{} }}}}'.format(i, (i + 1) % global_vars)
+                    if i % 10 == 0 else 'global value {} '.format(i) * 4
+                    for i in range(global_vars)}
+    write_yaml(os.path.join(envs_dir, 'globals.yaml'), globals_data)
+    for e in range(environments):
+        env_data = {'env_{}'.format(i): 'env {} value {}'.format(e, i) for i in range(env_vars)}
+        env_data['global_1'] = 'overwritten in env {}'.format(e)
+        write_yaml(os.path.join(envs_dir, 'env{}'.format(e), 'env.yaml'), env_data)
+    for s in range(services):
+        service_data = {'service_{}'.format(i): '${{{{ service }}}} value {}'.format(i)
+                        for i in range(service_vars)}
+        service_data['template_type'] = 'echo'
+        service_data['message'] = '${{ global_0 }} ${{ env_0 }}'
+        write_yaml(os.path.join(config_root, 'services', 'service{}'.format(s), 'conf.yaml'),
+                   service_data)
+    return config_root
+
+
+def measure(resolve_matrix):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    results = resolve_matrix()
+    elapsed = time.time() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--services', type=int, default=40)
+    parser.add_argument('--environments', type=int, default=8)
+    parser.add_argument('--global-vars', type=int, default=200)
+    parser.add_argument('--env-vars', type=int, default=50)
+    parser.add_argument('--service-vars', type=int, default=20)
+    args = parser.parse_args()
+
+    config_root = generate_config_root(args.services, args.environments, args.global_vars,
+                                       args.env_vars, args.service_vars)
+    try:
+        cfg = config.ExconfConfig(config_root)
+        services = cfg.list_services()
+        environments = cfg.list_environments()
+
+        def resolve_each():
+            return dict(((s, e), cfg.resolve_variables(s, e))
+                        for s in services for e in environments)
+
+        def resolve_compact():
+            return compact.MatrixResolver(cfg).resolve_all(services, environments)
+
+        plain, plain_current, plain_peak, plain_time = measure(resolve_each)
+        shared, shared_current, shared_peak, shared_time = measure(resolve_compact)
+        for combo, resolved in plain.items():
+            assert shared[combo].to_dict() == resolved, combo
+
+        print("{} services x {} environments, {} variables per combination".format(
+            len(services), len(environments), len(next(iter(plain.values())))))
+        print("{:<24}{:>14}{:>14}{:>10}".format('', 'retained MB', 'peak MB', 'seconds'))
+        for name, current, peak, elapsed in (
+                ('resolve_variables', plain_current, plain_peak, plain_time),
+                ('MatrixResolver', shared_current, shared_peak, shared_time)):
+            print("{:<24}{:>14.1f}{:>14.1f}{:>10.2f}".format(
+                name, current / 1024.0 / 1024.0, peak / 1024.0 / 1024.0, elapsed))
+        print("Retained memory reduced {:.1f}x".format(float(plain_current) / shared_current))
+    finally:
+        shutil.rmtree(config_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import re
+
+from exconf.config import (
+    EXCONF_VAR_CONFIG_ROOT,
+    EXCONF_VAR_SERVICES_DIR,
+    EXCONF_VAR_TEMPLATES_DIR,
+    EXCONF_VAR_ENVIRONMENTS_DIR,
+    EXCONF_VAR_TEMPLATE_TYPE,
+    EXCONF_VAR_TEMPLATE_COMMENT_BEGIN,
+    EXCONF_VAR_STR_TEMPLATE_PREFIX,
+    EXCONF_VAR_STR_TEMPLATE_SUFFIX,
+    EXCONF_VAR_FILE_TEMPLATE_PREFIX,
+    EXCONF_VAR_FILE_TEMPLATE_SUFFIX,
+    VariableLayerCache
+)
+from exconf.utils import (
+    get_logger,
+    find_template_vars,
+    find_filename_vars,
+    find_reference_cycles,
+    substitute_vars_until_done,
+    RecursionError,
+    REGEXP_INVALID_FILE_NAME_CHARS
+)
+
+ISSUE_MISSING_VARIABLE = 'missing_variable'
+ISSUE_REFERENCE_CYCLE = 'reference_cycle'
+ISSUE_INVALID_FILE_NAME = 'invalid_file_name_substitute'
+ISSUE_INVALID_CONFIG = 'invalid_configuration'
+
+# Variables needed for finding the template files for a service in an environment.
+TEMPLATE_LOOKUP_VARS = (EXCONF_VAR_CONFIG_ROOT, EXCONF_VAR_TEMPLATES_DIR, EXCONF_VAR_TEMPLATE_TYPE,
+                        EXCONF_VAR_SERVICES_DIR, EXCONF_VAR_ENVIRONMENTS_DIR)
+
+LOG = get_logger(os.path.basename(__file__))
+
+
+def make_issue(issue_type, service, environment, source, message, variable=None, line=None):
+    return {
+        'type': issue_type,
+        'service': service,
+        'environment': environment,
+        'source': source,
+        'variable': variable,
+        'line': line,
+        'message': message
+    }
+
+
+def format_issue(issue):
+    location = issue['source']
+    if issue['line'] is not None:
+        location = '{}:{}'.format(location, issue['line'])
+    return "{}/{}: {}: {}".format(issue['service'], issue['environment'], location,
+                                  issue['message'])
+
+
+class ExconfChecker(object):
+    """Statically checks service and environment combinations without populating templates.
+
+    The variable layers and the variables referenced by each value and template file are
+    read only once, and then reused for every combination they apply to.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.layers = VariableLayerCache(config)
+        self.__value_refs = {}
+        self.__template_refs = {}
+
+    def __find_value_refs(self, value, syntax):
+        key = (value, syntax)
+        if key not in self.__value_refs:
+            self.__value_refs[key] = find_template_vars(value, *syntax)
+        return self.__value_refs[key]
+
+    def __find_template_refs(self, file_path, syntax):
+        key = (file_path, syntax)
+        if key not in self.__template_refs:
+            with open(file_path) as f:
+                self.__template_refs[key] = find_template_vars(f.read(), *syntax)
+        return self.__template_refs[key]
+
+    def check(self, service, environment, extra_variables=None):
+        """Returns a list of issues found for given service in given environment."""
+        issues = []
+        all_vars = self.layers.load_all_variables(service, environment, extra_variables)
+        syntax = (all_vars.get(EXCONF_VAR_TEMPLATE_COMMENT_BEGIN),
+                  all_vars[EXCONF_VAR_STR_TEMPLATE_PREFIX],
+                  all_vars[EXCONF_VAR_STR_TEMPLATE_SUFFIX])
+
+        references = {}
+        for key in sorted(all_vars):
+            references[key] = set()
+            for line, var_name in self.__find_value_refs(str(all_vars[key]), syntax):
+                if var_name in all_vars:
+                    references[key].add(var_name)
+                else:
+                    issues.append(make_issue(
+                        ISSUE_MISSING_VARIABLE, service, environment, 'variable:' + key,
+                        "Variable '{}' not defined".format(var_name), var_name, line))
+
+        for cycle in find_reference_cycles(references):
+            issues.append(make_issue(
+                ISSUE_REFERENCE_CYCLE, service, environment, 'variable:' + cycle[0],
+                "Variables reference each other in a loop: {}".format(', '.join(cycle)),
+                cycle[0]))
+
+        lookup_vars = dict(all_vars)
+        for name in TEMPLATE_LOOKUP_VARS:
+            if name in all_vars:
+                lookup_vars[name] = self.__resolve_var(name, all_vars, syntax)
+        templates_dir = os.path.join(lookup_vars[EXCONF_VAR_CONFIG_ROOT],
+                                     lookup_vars[EXCONF_VAR_TEMPLATES_DIR])
+        if not os.path.isdir(templates_dir):
+            issues.append(make_issue(ISSUE_INVALID_CONFIG, service, environment,
+                                     EXCONF_VAR_TEMPLATES_DIR,
+                                     "Templates directory does not exist: {}"
+                                     .format(templates_dir)))
+            return issues
+        try:
+            template_files = self.config.list_template_files(service, environment,
+                                                             all_vars=lookup_vars)
+        except KeyError as err:
+            issues.append(make_issue(ISSUE_INVALID_CONFIG, service, environment, err.args[0],
+                                     "Variable '{}' not defined".format(err.args[0])))
+            return issues
+        except ValueError as err:
+            issues.append(make_issue(ISSUE_INVALID_CONFIG, service, environment,
+                                     EXCONF_VAR_TEMPLATE_TYPE, str(err)))
+            return issues
+
+        file_prefix = all_vars[EXCONF_VAR_FILE_TEMPLATE_PREFIX]
+        file_suffix = all_vars[EXCONF_VAR_FILE_TEMPLATE_SUFFIX]
+        for file_path in template_files:
+            for line, var_name in self.__find_template_refs(file_path, syntax):
+                if var_name not in all_vars:
+                    issues.append(make_issue(
+                        ISSUE_MISSING_VARIABLE, service, environment, file_path,
+                        "Variable '{}' not defined".format(var_name), var_name, line))
+            for var_name in find_filename_vars(os.path.basename(file_path),
+                                               file_prefix, file_suffix):
+                if var_name not in all_vars:
+                    issues.append(make_issue(
+                        ISSUE_MISSING_VARIABLE, service, environment, file_path,
+                        "File name variable '{}' not defined".format(var_name), var_name))
+                    continue
+                substitute = self.__resolve_var(var_name, all_vars, syntax)
+                if re.search(REGEXP_INVALID_FILE_NAME_CHARS, substitute):
+                    issues.append(make_issue(
+                        ISSUE_INVALID_FILE_NAME, service, environment, file_path,
+                        "Invalid file name substitute (var {}): {}".format(var_name, substitute),
+                        var_name))
+        return issues
+
+    @staticmethod
+    def __resolve_var(name, all_vars, syntax):
+        """Resolves a single variable. Variables ending up in reference loops are left as is,
+        the loops are reported separately."""
+        comment_begin, template_prefix, template_suffix = syntax
+        try:
+            return substitute_vars_until_done(str(all_vars[name]), all_vars, False,
+                                              comment_begin, template_prefix, template_suffix)
+        except RecursionError:
+            return str(all_vars[name])
+
+    def check_all(self, services=None, environments=None, extra_variables=None):
+        """Checks every given service in every given environment, by default all of them."""
+        issues = []
+        services = services or self.config.list_services()
+        environments = environments or self.config.list_environments()
+        for service in services:
+            for environment in environments:
+                LOG.info("Checking service '{}' in env '{}'", service, environment)
+                issues.extend(self.check(service, environment, extra_variables))
+        return issues
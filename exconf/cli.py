@@ -16,6 +16,7 @@ import click
 import json
 import os
 
+from exconf.check import ExconfChecker, format_issue
 from exconf.config import ExconfConfig
 from exconf.utils import (
     get_logger,
@@ -121,24 +122,55 @@ def template(ctx, service, environment, extra_var, ignore_missing, write_to_dir)
 
     if write_to_dir:
         output("Write out templates to directory: {}".format(write_to_dir))
-        target_dir = cfg.prepare_templated_work_dir(service, environment,
-                                                    parse_extra_vars(extra_var),
-                                                    require_all_replaced, write_to_dir)
+        render_ctx = cfg.create_render_context(service, environment, parse_extra_vars(extra_var),
+                                               require_all_replaced)
+        target_dir = render_ctx.prepare_work_dir(write_to_dir)
         if target_dir:
             output("Successfully wrote template files: {}".format(os.listdir(target_dir)))
         else:
             output("Writing out template files failed", color="red")
     else:
-        for file_path in cfg.list_template_files(service, environment, parse_extra_vars(extra_var)):
-            data = cfg.populate_template(file_path, require_all_replaced)
+        # Only the variables used in the templates need to be defined.
+        render_ctx = cfg.create_render_context(service, environment, parse_extra_vars(extra_var),
+                                               False)
+        for file_path in render_ctx.list_template_files():
+            data = render_ctx.populate_template(file_path, require_all_replaced)
 
             output('### ' + file_path, color='blue')
-            output('### ' + cfg.parse_filename_var(os.path.basename(file_path)) + ' ###',
+            output('### ' + render_ctx.parse_filename_var(os.path.basename(file_path)) + ' ###',
                    color='blue')
             output(data)
             output('### END ###', color='blue')
 
 
+@cli.command('check')
+@click.option('-s', '--service', multiple=True,
+              help='Service name. You can define this multiple times. Defaults to all services.')
+@click.option('-e', '--environment', multiple=True,
+              help='Environment name. You can define this multiple times. '
+                   'Defaults to all environments.')
+@click.option('-x', '--extra-var', multiple=True,
+              help='Extra variables, as "key=value" pairs. You can define this multiple times.')
+@click.option('-j', '--json', 'as_json', is_flag=True, default=False,
+              help='Output found issues as JSON.')
+@click.pass_context
+def check(ctx, service, environment, extra_var, as_json):
+    """Check variables and templates of all services in all environments
+    without populating the templates."""
+    issues = ExconfChecker(get_config(ctx)).check_all(service, environment,
+                                                      parse_extra_vars(extra_var))
+    if as_json:
+        click.echo(json.dumps(issues, indent=2, sort_keys=True))
+    elif not issues:
+        output("No issues found")
+    else:
+        for issue in issues:
+            output(format_issue(issue), color='red')
+        output("Found {} issues".format(len(issues)), color='red')
+    if issues:
+        ctx.exit(1)
+
+
 @cli.command('execute')
 @click.option('-s', '--service', help='Service name.', required=True)
 @click.option('-e', '--environment', help='Environment name.', required=True)
@@ -148,14 +180,40 @@ def template(ctx, service, environment, extra_var, ignore_missing, write_to_dir)
               help='Do not fail on undefined variables in templates.')
 @click.pass_context
 def execute(ctx, service, environment, extra_var, ignore_missing):
-    """Execute command on temporary directory with resolved templates
+    """Execute command on cached work directory with resolved templates
     for given service in given environment."""
-    cfg = get_config(ctx)
-    require_all_replaced = not ignore_missing
-    target_dir = cfg.prepare_templated_work_dir(service, environment,
-                                                parse_extra_vars(extra_var), require_all_replaced)
-    exec_cmd = cfg.get_execution_command()
-    call_shell(target_dir, exec_cmd)
+    render_ctx = get_config(ctx).create_render_context(service, environment,
+                                                       parse_extra_vars(extra_var),
+                                                       not ignore_missing)
+    with render_ctx.use_work_dir() as target_dir:
+        if not target_dir:
+            output("Preparing work directory failed", color="red")
+            ctx.exit(1)
+        exec_cmd = render_ctx.get_execution_command()
+        call_shell(target_dir, exec_cmd)
+
+
+@cli.command('cleanup')
+@click.option('-n', '--max-entries', type=int, default=None,
+              help='Keep at most this many work directories. Defaults to configured value.')
+@click.option('-a', '--max-age', type=int, default=None,
+              help='Remove work directories unused for this many seconds. '
+                   'Defaults to configured value.')
+@click.option('--all', 'remove_all', is_flag=True, default=False,
+              help='Remove all cached work directories.')
+@click.pass_context
+def cleanup(ctx, max_entries, max_age, remove_all):
+    """Evict cached execution work directories."""
+    work_dir_cache = get_config(ctx).get_work_dir_cache()
+    if remove_all:
+        removed = work_dir_cache.clear()
+    else:
+        removed = work_dir_cache.evict(max_entries, max_age)
+    if not removed:
+        output("No work directories removed from: {}".format(work_dir_cache.cache_root),
+               color='yellow')
+    for x in removed:
+        output("Removed: {}".format(x))
 
 
 def main():
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import threading
+
+from exconf.config import (
+    EXCONF_VAR_TEMPLATE_COMMENT_BEGIN,
+    EXCONF_VAR_STR_TEMPLATE_PREFIX,
+    EXCONF_VAR_STR_TEMPLATE_SUFFIX,
+    RenderContext,
+    VariableLayerCache
+)
+from exconf.utils import (
+    get_logger,
+    find_template_vars,
+    substitute_vars_until_done,
+    RecursionError
+)
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+LOG = get_logger(os.path.basename(__file__))
+
+
+def same_value(a, b):
+    return a is b or (type(a) is type(b) and a == b)
+
+
+class ValuePool(object):
+    """Interns values, so that equal resolved values are stored only once."""
+
+    def __init__(self):
+        self.__values = {}
+
+    def intern(self, value):
+        return self.__values.setdefault(value, value)
+
+    def __len__(self):
+        return len(self.__values)
+
+
+class SharedVariables(Mapping):
+    """Read-only resolved variables for one service in one environment.
+
+    The variables are split into layers: variables resolving the same way for all services
+    in all environments, variables resolving the same way for all services in the environment,
+    and the rest. Only the last layer is owned by this instance, the other layers are shared
+    with all the other combinations resolved by the same MatrixResolver.
+    """
+
+    def __init__(self, own_vars, env_vars, global_vars):
+        self.__layers = (own_vars, env_vars, global_vars)
+        self.__len = None
+
+    def __getitem__(self, key):
+        for layer in self.__layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self.__layers)
+
+    def __iter__(self):
+        own_vars, env_vars, global_vars = self.__layers
+        for key in own_vars:
+            yield key
+        for key in env_vars:
+            if key not in own_vars:
+                yield key
+        for key in global_vars:
+            if key not in own_vars and key not in env_vars:
+                yield key
+
+    def __len__(self):
+        # The shared layers may get more keys later, but only keys this instance also has.
+        if self.__len is None:
+            self.__len = sum(1 for _ in self)
+        return self.__len
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+class MatrixResolver(object):
+    """Resolves variables for many service and environment combinations, sharing memory
+    between them.
+
+    A variable is resolved only once for all combinations, if its value and the values of all
+    the variables it refers to, recursively, are the same in the combinations. All resolved
+    values are interned. The results are equal to ExconfConfig.resolve_variables.
+    """
+
+    def __init__(self, config, require_all_replaced=True):
+        self.config = config
+        self.require_all_replaced = require_all_replaced
+        self.layers = VariableLayerCache(config)
+        self.pool = ValuePool()
+        self.__lock = threading.Lock()
+        self.__refs = {}
+        self.__global_vars = None
+        self.__env_vars = {}
+        self.__global_resolved = {}
+        self.__env_resolved = {}
+
+    def __load_global_level(self):
+        if self.__global_vars is None:
+            self.__global_vars = self.layers.load_all_variables(None, None)
+        return self.__global_vars
+
+    def __load_env_level(self, environment):
+        if environment not in self.__env_vars:
+            self.__env_vars[environment] = self.layers.load_all_variables(None, environment)
+        return self.__env_vars[environment]
+
+    def __find_refs(self, value, syntax):
+        key = (str(value), syntax)
+        if key not in self.__refs:
+            self.__refs[key] = frozenset(var_name for _, var_name
+                                         in find_template_vars(key[0], *syntax))
+        return self.__refs[key]
+
+    @staticmethod
+    def __get_syntax(all_vars):
+        return (all_vars.get(EXCONF_VAR_TEMPLATE_COMMENT_BEGIN),
+                all_vars.get(EXCONF_VAR_STR_TEMPLATE_PREFIX),
+                all_vars.get(EXCONF_VAR_STR_TEMPLATE_SUFFIX))
+
+    def __resolve(self, key, all_vars, syntax, resolved):
+        if key not in resolved:
+            try:
+                resolved[key] = self.pool.intern(substitute_vars_until_done(
+                    str(all_vars[key]), all_vars, self.require_all_replaced, *syntax))
+            except RecursionError as err:
+                LOG.error("Failed substituting key '{}'. {}", key, err)
+                raise err
+        return resolved[key]
+
+    def __shared_keys(self, all_vars, level_vars, referenced_by, syntax):
+        """Returns the keys in all_vars resolving the same way with level_vars."""
+        if self.__get_syntax(level_vars) != syntax:
+            return set()
+        differing = [key for key in all_vars
+                     if key not in level_vars or not same_value(all_vars[key], level_vars[key])]
+        # Every variable referring to a differing variable, recursively, differs too.
+        seen = set(differing)
+        while differing:
+            for key in referenced_by.get(differing.pop(), ()):
+                if key not in seen:
+                    seen.add(key)
+                    differing.append(key)
+        return set(all_vars).difference(seen)
+
+    def resolve(self, service, environment, extra_variables=None):
+        """Resolves all variables for given service in given environment into
+        a SharedVariables mapping."""
+        with self.__lock:
+            all_vars = self.layers.load_all_variables(service, environment, extra_variables)
+            syntax = self.__get_syntax(all_vars)
+            referenced_by = {}
+            for key in all_vars:
+                for var_name in self.__find_refs(all_vars[key], syntax):
+                    referenced_by.setdefault(var_name, []).append(key)
+
+            global_vars = self.__load_global_level()
+            env_vars = self.__load_env_level(environment)
+            global_keys = self.__shared_keys(all_vars, global_vars, referenced_by, syntax)
+            env_keys = self.__shared_keys(all_vars, env_vars, referenced_by, syntax)
+            global_resolved = self.__global_resolved
+            env_resolved = self.__env_resolved.setdefault(environment, {})
+
+            own_vars = {}
+            for key in all_vars:
+                if key in env_keys and key in global_keys:
+                    self.__resolve(key, global_vars, syntax, global_resolved)
+                elif key in env_keys:
+                    self.__resolve(key, env_vars, syntax, env_resolved)
+                elif key in global_keys:
+                    # Overwritten in the environment, and back to the global value later on.
+                    own_vars[key] = self.__resolve(key, global_vars, syntax, global_resolved)
+                else:
+                    self.__resolve(key, all_vars, syntax, own_vars)
+            return SharedVariables(own_vars, env_resolved, global_resolved)
+
+    def resolve_all(self, services=None, environments=None, extra_variables=None):
+        """Resolves every given service in every given environment, by default all of them.
+        Returns a dict of (service, environment) -> SharedVariables."""
+        services = services or self.config.list_services()
+        environments = environments or self.config.list_environments()
+        return dict(((service, environment),
+                     self.resolve(service, environment, extra_variables))
+                    for service in services for environment in environments)
+
+    def create_render_context(self, service, environment, extra_variables=None):
+        return RenderContext(self.config, service, environment,
+                             self.resolve(service, environment, extra_variables),
+                             self.require_all_replaced)
@@ -11,9 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import contextlib
 import copy
 import os
-import tempfile
 
 from exconf.utils import (
     read_yaml,
@@ -24,6 +24,17 @@ from exconf.utils import (
     substitute_vars_until_done,
     parse_filename_var
 )
+from exconf.workdir import (
+    DEFAULT_WORK_DIR_CACHE_ROOT,
+    DEFAULT_WORK_DIR_CACHE_MAX_ENTRIES,
+    DEFAULT_WORK_DIR_CACHE_MAX_AGE,
+    WorkDirCache,
+    write_rendered_files
+)
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 EXCONF_CONFIG_FILE_NAME = 'exconf.yaml'
 
@@ -41,42 +52,65 @@ EXCONF_VAR_FILE_TEMPLATE_PREFIX = 'file_name_template_prefix'
 EXCONF_VAR_FILE_TEMPLATE_SUFFIX = 'file_name_template_suffix'
 EXCONF_VAR_EXECUTION_COMMAND = 'execution_command'
 EXCONF_VAR_EXECUTION_FILE = 'execution_file'
+EXCONF_VAR_WORK_DIR_CACHE_ROOT = 'work_dir_cache_root'
+EXCONF_VAR_WORK_DIR_CACHE_MAX_ENTRIES = 'work_dir_cache_max_entries'
+EXCONF_VAR_WORK_DIR_CACHE_MAX_AGE = 'work_dir_cache_max_age'
+# Read from exconf.yaml only, as is, so that every command uses the same work directory cache.
+WORK_DIR_CACHE_VARS = (EXCONF_VAR_WORK_DIR_CACHE_ROOT, EXCONF_VAR_WORK_DIR_CACHE_MAX_ENTRIES,
+                       EXCONF_VAR_WORK_DIR_CACHE_MAX_AGE)
 
 LOG = get_logger(os.path.basename(__file__))
 
 
+class ReadOnlyVariables(Mapping):
+    """Read-only view to resolved variables."""
+
+    def __init__(self, variables):
+        self.__variables = variables
+
+    def __getitem__(self, key):
+        return self.__variables[key]
+
+    def __contains__(self, key):
+        return key in self.__variables
+
+    def __iter__(self):
+        return iter(self.__variables)
+
+    def __len__(self):
+        return len(self.__variables)
+
+
 class ExconfConfig(object):
-    config_vars = None
+    """Exconf configuration loaded from a configuration root.
 
-    # This is cached resolved variables if you call this multiple times.
-    resolved_vars = None
+    The instance is not modified after loading, so a single instance can be shared between
+    threads. Templates are populated through render contexts, see create_render_context.
+    """
+    config_vars = None
 
     def __init__(self, config_root):
         self._init_variables(config_root)
 
-    def __get_vars(self):
-        """Return the variables resolved, or if not resolved yet, then only the config vars."""
-        if self.resolved_vars:
-            return self.resolved_vars
-        return self.config_vars
-
     def __get_services_root_dir(self):
-        the_dir = os.path.join(self.__get_vars()[EXCONF_VAR_CONFIG_ROOT],
-                               self.__get_vars()[EXCONF_VAR_SERVICES_DIR])
+        the_dir = os.path.join(self.config_vars[EXCONF_VAR_CONFIG_ROOT],
+                               self.config_vars[EXCONF_VAR_SERVICES_DIR])
         if not os.path.isdir(the_dir):
             raise ValueError("Services directory does not exist: {}".format(the_dir))
         return the_dir
 
-    def __get_templates_root_dir(self):
-        the_dir = os.path.join(self.__get_vars()[EXCONF_VAR_CONFIG_ROOT],
-                               self.__get_vars()[EXCONF_VAR_TEMPLATES_DIR])
+    def __get_templates_root_dir(self, all_vars=None):
+        if all_vars is None:
+            all_vars = self.config_vars
+        the_dir = os.path.join(all_vars[EXCONF_VAR_CONFIG_ROOT],
+                               all_vars[EXCONF_VAR_TEMPLATES_DIR])
         if not os.path.isdir(the_dir):
             raise ValueError("Templates directory does not exist: {}".format(the_dir))
         return the_dir
 
     def __get_environments_root_dir(self):
-        the_dir = os.path.join(self.__get_vars()[EXCONF_VAR_CONFIG_ROOT],
-                               self.__get_vars()[EXCONF_VAR_ENVIRONMENTS_DIR])
+        the_dir = os.path.join(self.config_vars[EXCONF_VAR_CONFIG_ROOT],
+                               self.config_vars[EXCONF_VAR_ENVIRONMENTS_DIR])
         if not os.path.isdir(the_dir):
             raise ValueError("Environments directory does not exist: {}".format(the_dir))
         return the_dir
@@ -84,7 +118,7 @@ class ExconfConfig(object):
     def __get_services_root_dir_for_env(self, environment):
         return os.path.join(self.__get_environments_root_dir(),
                             environment,
-                            self.__get_vars()[EXCONF_VAR_SERVICES_DIR])
+                            self.config_vars[EXCONF_VAR_SERVICES_DIR])
 
     def _init_variables(self, config_root):
         """Initializes the root configuration variables for this instance."""
@@ -103,13 +137,28 @@ class ExconfConfig(object):
         LOG.debug("Reading Exconf configuration from: {}", exconf_config_file_path)
         self.config_vars = read_yaml(exconf_config_file_path)
         self.config_vars[EXCONF_VAR_CONFIG_ROOT] = config_root
-        self.resolved_vars = None
 
-    def get_execution_file(self):
-        return self.__get_vars()[EXCONF_VAR_EXECUTION_FILE]
-
-    def get_execution_command(self):
-        return self.__get_vars()[EXCONF_VAR_EXECUTION_COMMAND]
+    def get_work_dir_cache(self, resolved_vars=None):
+        """Returns the execution work directory cache configured in exconf.yaml. The cache
+        settings can not refer to other variables, and if resolved_vars are given, they must
+        not redefine the settings either."""
+        config_vars = self.config_vars
+        for name in WORK_DIR_CACHE_VARS:
+            value = config_vars.get(name)
+            if value is not None and config_vars[EXCONF_VAR_STR_TEMPLATE_PREFIX] in str(value):
+                raise ValueError("Variable {} must not refer to other variables: {}"
+                                 .format(name, value))
+            if resolved_vars is not None and name in resolved_vars and \
+                    str(resolved_vars[name]) != str(value):
+                raise ValueError("Variable {} can only be defined in {}"
+                                 .format(name, EXCONF_CONFIG_FILE_NAME))
+        return WorkDirCache(
+            os.path.expanduser(config_vars.get(EXCONF_VAR_WORK_DIR_CACHE_ROOT) or
+                               DEFAULT_WORK_DIR_CACHE_ROOT),
+            int(config_vars.get(EXCONF_VAR_WORK_DIR_CACHE_MAX_ENTRIES,
+                                DEFAULT_WORK_DIR_CACHE_MAX_ENTRIES)),
+            int(config_vars.get(EXCONF_VAR_WORK_DIR_CACHE_MAX_AGE,
+                                DEFAULT_WORK_DIR_CACHE_MAX_AGE)))
 
     def list_services(self):
         the_dir = self.__get_services_root_dir()
@@ -147,17 +196,28 @@ class ExconfConfig(object):
             os.path.join(self.__get_services_root_dir_for_env(environment), service)
         return read_and_combine_yamls_in_dir(service_dir_for_env)
 
-    def load_all_variables(self, service, environment, extra_variables=None):
+    def load_all_variables(self, service, environment, extra_variables=None, layers=None):
         """Loads all variables for given service in given environment. Resolves and combines
         all variables in specific order, which is also described in the project readme.
+
+        Without service, loads only the variables common to all services in the environment,
+        and without environment also, the variables common to all environments. The variable
+        layers are loaded with the given layers object, by default this instance.
         """
+        if layers is None:
+            layers = self
         all_vars = copy.deepcopy(self.config_vars)
-        all_vars[EXCONF_VAR_SERVICE] = service
-        all_vars[EXCONF_VAR_ENVIRONMENT] = environment
-        all_vars.update(self.load_global_variables())
-        all_vars.update(self.load_env_variables(environment))
-        all_vars.update(self.load_service_variables(service))
-        all_vars.update(self.load_service_variables_for_env(service, environment))
+        if service is not None:
+            all_vars[EXCONF_VAR_SERVICE] = service
+        if environment is not None:
+            all_vars[EXCONF_VAR_ENVIRONMENT] = environment
+        all_vars.update(layers.load_global_variables())
+        if environment is not None:
+            all_vars.update(layers.load_env_variables(environment))
+        if service is not None:
+            all_vars.update(layers.load_service_variables(service))
+            if environment is not None:
+                all_vars.update(layers.load_service_variables_for_env(service, environment))
         if extra_variables:
             all_vars.update(extra_variables)
         return all_vars
@@ -166,15 +226,23 @@ class ExconfConfig(object):
                           require_all_replaced=True):
         """Loads all variables and resolves also the string templates within the variables."""
         all_vars = self.load_all_variables(service, environment, extra_variables)
-        self.resolved_vars = recursive_replace_vars(
+        return recursive_replace_vars(
             all_vars, require_all_replaced,
             all_vars[EXCONF_VAR_TEMPLATE_COMMENT_BEGIN],
             all_vars[EXCONF_VAR_STR_TEMPLATE_PREFIX],
             all_vars[EXCONF_VAR_STR_TEMPLATE_SUFFIX])
-        return self.resolved_vars
+
+    def create_render_context(self, service, environment, extra_variables=None,
+                              require_all_replaced=True):
+        """Resolves all variables for given service in given environment into a new
+        RenderContext, which is then used for populating the templates."""
+        return RenderContext(self, service, environment,
+                             self.resolve_variables(service, environment, extra_variables,
+                                                    require_all_replaced),
+                             require_all_replaced)
 
     def list_template_files(self, service, environment, extra_variables=None, all_vars=None):
-        if not all_vars:
+        if all_vars is None:
             all_vars = self.resolve_variables(service, environment, extra_variables, False)
         if EXCONF_VAR_TEMPLATE_TYPE not in all_vars:
             raise ValueError("Template type (var {}) not defined.".format(EXCONF_VAR_TEMPLATE_TYPE))
@@ -184,7 +252,7 @@ class ExconfConfig(object):
         var_services = all_vars[EXCONF_VAR_SERVICES_DIR]
 
         # 1. templates/<template_type>/*
-        template_root_dir = os.path.join(self.__get_templates_root_dir(), template_type)
+        template_root_dir = os.path.join(self.__get_templates_root_dir(all_vars), template_type)
         if not template_type or not os.path.isdir(template_root_dir):
             raise ValueError("Template type '{}' not defined. Expected path: {}"
                              .format(template_type, template_root_dir))
@@ -207,61 +275,167 @@ class ExconfConfig(object):
         LOG.info("Found {} template files in total: {}", len(seen_file_names), seen_file_names)
         return all_templates
 
-    def populate_template(self, template_file_path, require_all_replaced=True):
+    def render_template_files(self, service, environment, extra_variables=None,
+                              require_all_replaced=True):
+        """Resolves and populates all templates for given service in given environment.
+
+        Returns a list of (target_file_name, data, file_mode) tuples, or None if some template
+        could not be populated.
+        """
+        return self.create_render_context(service, environment, extra_variables,
+                                          require_all_replaced).render_template_files()
+
+    def prepare_templated_work_dir(self, service, environment, extra_variables=None,
+                                   require_all_replaced=True, target_dir=None):
+        """Populates the templates into given target directory, or into a cached work
+        directory. See RenderContext.prepare_work_dir.
+        """
+        return self.create_render_context(service, environment, extra_variables,
+                                          require_all_replaced).prepare_work_dir(target_dir)
+
+
+class RenderContext(object):
+    """Variables resolved for one service in one environment, and the operations for
+    populating the templates with them.
+
+    Create with ExconfConfig.create_render_context. Each render uses its own context,
+    so concurrent renders sharing the same ExconfConfig do not affect each other. The
+    resolved variables are exposed as a read-only mapping.
+    """
+
+    def __init__(self, config, service, environment, resolved_vars, require_all_replaced=True):
+        if isinstance(resolved_vars, dict):
+            resolved_vars = ReadOnlyVariables(resolved_vars)
+        self.config = config
+        self.service = service
+        self.environment = environment
+        self.resolved_vars = resolved_vars
+        self.require_all_replaced = require_all_replaced
+
+    def get_execution_file(self):
+        return self.resolved_vars[EXCONF_VAR_EXECUTION_FILE]
+
+    def get_execution_command(self):
+        return self.resolved_vars[EXCONF_VAR_EXECUTION_COMMAND]
+
+    def list_template_files(self):
+        return self.config.list_template_files(self.service, self.environment,
+                                               all_vars=self.resolved_vars)
+
+    def populate_template(self, template_file_path, require_all_replaced=None):
+        """Populates given template file. Missing variables fail as configured for this context,
+        unless require_all_replaced is given."""
+        if require_all_replaced is None:
+            require_all_replaced = self.require_all_replaced
         LOG.debug("Populating template {} from file: {}",
                   os.path.basename(template_file_path), template_file_path)
-        data = open(template_file_path).read()
-        return substitute_vars_until_done(data, self.__get_vars(), require_all_replaced,
-                                          self.__get_vars()[EXCONF_VAR_TEMPLATE_COMMENT_BEGIN],
-                                          self.__get_vars()[EXCONF_VAR_STR_TEMPLATE_PREFIX],
-                                          self.__get_vars()[EXCONF_VAR_STR_TEMPLATE_SUFFIX])
+        with open(template_file_path) as f:
+            data = f.read()
+        all_vars = self.resolved_vars
+        return substitute_vars_until_done(data, all_vars, require_all_replaced,
+                                          all_vars[EXCONF_VAR_TEMPLATE_COMMENT_BEGIN],
+                                          all_vars[EXCONF_VAR_STR_TEMPLATE_PREFIX],
+                                          all_vars[EXCONF_VAR_STR_TEMPLATE_SUFFIX])
 
     def parse_filename_var(self, file_name):
-        all_vars = self.__get_vars()
+        all_vars = self.resolved_vars
         return parse_filename_var(file_name, all_vars,
                                   all_vars[EXCONF_VAR_FILE_TEMPLATE_PREFIX],
                                   all_vars[EXCONF_VAR_FILE_TEMPLATE_SUFFIX])
 
-    def populate_and_write_template_file(self, template_file_path, target_dir, file_mode=0o640,
-                                         require_all_replaced=True):
-        if not os.path.isdir(target_dir):
-            raise ValueError("Target diretory does not exist: {}".format(target_dir))
-        try:
-            data = self.populate_template(template_file_path, require_all_replaced)
-        except KeyError as err:
-            LOG.error("Variable '{}' not defined for template file '{}'"
-                      .format(err.args[0], template_file_path))
-            LOG.info("Failed creating work directory into dir: {}", target_dir)
-            return False
-
-        target_base_name = self.parse_filename_var(os.path.basename(template_file_path))
-        target_file_path = os.path.join(target_dir, target_base_name)
-        LOG.info("Writing template file: {}", target_file_path)
-        open(target_file_path, 'w').write(data)
-        os.chmod(target_file_path, file_mode)
-        return True
+    def render_template_files(self):
+        """Populates all templates for this context.
 
-    def prepare_templated_work_dir(self, service, environment, extra_variables=None,
-                                   require_all_replaced=True, target_dir=None):
-        if not target_dir:
-            target_dir = tempfile.mkdtemp()
-        if not os.path.isdir(target_dir):
-            os.makedirs(target_dir, 0o770)
-        LOG.info("Preparing temporary execution dir for service '{}' in env '{}': {}",
-                 service, environment, target_dir)
-        all_vars = self.resolve_variables(service, environment, extra_variables,
-                                          require_all_replaced)
+        Returns a list of (target_file_name, data, file_mode) tuples, or None if some template
+        could not be populated.
+        """
         exec_file_name = self.get_execution_file()
 
-        for file_path in self.list_template_files(service, environment, extra_variables, all_vars):
+        rendered_files = []
+        for file_path in self.list_template_files():
             file_mode = 0o640
             if os.path.basename(file_path) == exec_file_name:
                 file_mode = 0o770
-            success = self.populate_and_write_template_file(file_path, target_dir, file_mode,
-                                                            require_all_replaced)
-            if not success:
-                LOG.error("Failed writing template file '{}' into target directory: {}",
-                          file_path, target_dir)
+            try:
+                data = self.populate_template(file_path)
+            except KeyError as err:
+                LOG.error("Variable '{}' not defined for template file '{}'"
+                          .format(err.args[0], file_path))
                 return None
+            target_base_name = self.parse_filename_var(os.path.basename(file_path))
+            rendered_files.append((target_base_name, data, file_mode))
+        return rendered_files
+
+    def prepare_work_dir(self, target_dir=None):
+        """Populates the templates into given target directory. Without target directory
+        the templates are populated into a work directory from the work directory cache,
+        reusing an existing directory if the populated content is identical.
+        """
+        rendered_files = self.__render_for_work_dir()
+        if rendered_files is None:
+            return None
 
+        if not target_dir:
+            return self.config.get_work_dir_cache(self.resolved_vars).get_work_dir(rendered_files)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir, 0o770)
+        write_rendered_files(rendered_files, target_dir)
         return os.path.abspath(target_dir)
+
+    @contextlib.contextmanager
+    def use_work_dir(self):
+        """Yields a work directory from the work directory cache with the populated templates,
+        or None if populating failed. The directory is not evicted before the with block
+        exits."""
+        rendered_files = self.__render_for_work_dir()
+        if rendered_files is None:
+            yield None
+            return
+        work_dir_cache = self.config.get_work_dir_cache(self.resolved_vars)
+        with work_dir_cache.use_work_dir(rendered_files) as work_dir:
+            yield work_dir
+
+    def __render_for_work_dir(self):
+        LOG.info("Preparing execution dir for service '{}' in env '{}'",
+                 self.service, self.environment)
+        rendered_files = self.render_template_files()
+        if rendered_files is None:
+            LOG.error("Failed populating templates for service '{}' in env '{}'",
+                      self.service, self.environment)
+        return rendered_files
+
+
+class VariableLayerCache(object):
+    """Loads the variable layers shared between services and environments only once.
+
+    Useful when handling many service and environment combinations with the same
+    ExconfConfig. The returned layers are shared, and must not be modified.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.__global_vars = None
+        self.__env_vars = {}
+        self.__service_vars = {}
+
+    def load_global_variables(self):
+        if self.__global_vars is None:
+            self.__global_vars = self.config.load_global_variables()
+        return self.__global_vars
+
+    def load_env_variables(self, environment):
+        if environment not in self.__env_vars:
+            self.__env_vars[environment] = self.config.load_env_variables(environment)
+        return self.__env_vars[environment]
+
+    def load_service_variables(self, service):
+        if service not in self.__service_vars:
+            self.__service_vars[service] = self.config.load_service_variables(service)
+        return self.__service_vars[service]
+
+    def load_service_variables_for_env(self, service, environment):
+        return self.config.load_service_variables_for_env(service, environment)
+
+    def load_all_variables(self, service, environment, extra_variables=None):
+        """Same as ExconfConfig.load_all_variables, reusing the shared variable layers."""
+        return self.config.load_all_variables(service, environment, extra_variables, self)
@@ -208,3 +208,92 @@ def parse_filename_var(file_name, all_vars, template_prefix='___', template_suff
             LOG.info("Did not find file name template suffix for parsing: {}", file_name)
             break
     return file_name
+
+
+def find_template_vars(data, comment_begin, template_prefix, template_suffix):
+    """Lists (line, var_name) of all string template variables referenced in given data,
+    without substituting anything. Follows the same parsing rules as substitute_vars.
+    """
+    found_vars = []
+    line_num = 0
+    for line in data.split('\n'):
+        line_num += 1
+        if comment_begin and line.strip().startswith(comment_begin):
+            continue
+        i = line.find(template_prefix)
+        while i >= 0:
+            i += len(template_prefix)
+            j = line.find(template_suffix, i)
+            if j > i:
+                found_vars.append((line_num, line[i:j].strip()))
+                i = j + len(template_suffix)
+            i = line.find(template_prefix, i)
+    return found_vars
+
+
+def find_filename_vars(file_name, template_prefix='___', template_suffix='___'):
+    """Lists all file name variables referenced in given file name, in order of appearance.
+    Follows the same parsing rules as parse_filename_var.
+    """
+    found_vars = []
+    i = file_name.find(template_prefix)
+    while i >= 0:
+        j = file_name.find(template_suffix, i + len(template_prefix))
+        if j <= i:
+            break
+        found_vars.append(file_name[i + len(template_prefix):j])
+        i = file_name.find(template_prefix, j + len(template_suffix))
+    return found_vars
+
+
+def find_reference_cycles(references):
+    """Finds reference loops in given dict of name -> set of referenced names.
+
+    Returns sorted lists of names forming a loop, i.e. the strongly connected components
+    with more than one member, or a single member referencing itself.
+    """
+    index_of = {}
+    low_link = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    next_index = 0
+    for root in sorted(references):
+        if root in index_of:
+            continue
+        # Iterative Tarjan's algorithm, deep variable chains would exceed recursion limits.
+        work = [(root, iter(sorted(references[root])))]
+        index_of[root] = low_link[root] = next_index
+        next_index += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in references:
+                    continue
+                if child not in index_of:
+                    index_of[child] = low_link[child] = next_index
+                    next_index += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(references[child]))))
+                elif child in on_stack:
+                    low_link[node] = min(low_link[node], index_of[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low_link[parent] = min(low_link[parent], low_link[node])
+            if low_link[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in references[node]:
+                    cycles.append(sorted(component))
+    return cycles
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from exconf.utils import get_logger
+
+DEFAULT_WORK_DIR_CACHE_ROOT = os.path.join('~', '.cache', 'exconf', 'work-dirs')
+DEFAULT_WORK_DIR_CACHE_MAX_ENTRIES = 50
+DEFAULT_WORK_DIR_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+WORK_DIR_TMP_PREFIX = '.tmp-'
+# Work directories in use hold a shared lock on this file next to them, eviction an exclusive one.
+WORK_DIR_LOCK_SUFFIX = '.lock'
+# Temporary directories of interrupted renders are removed after this many seconds.
+WORK_DIR_TMP_GRACE_PERIOD = 24 * 60 * 60
+
+LOG = get_logger(os.path.basename(__file__))
+
+
+def hash_rendered_files(rendered_files):
+    """Returns a hex digest identifying the given rendered files.
+
+    The rendered files are (file_name, data, file_mode) tuples. The digest is independent
+    of the order of the files, so the same render always maps to the same work directory.
+    """
+    digest = hashlib.sha256()
+    for file_name, data, file_mode in sorted(rendered_files):
+        for part in (file_name, oct(file_mode), data):
+            encoded = part if isinstance(part, bytes) else part.encode('utf-8')
+            digest.update(str(len(encoded)).encode('utf-8'))
+            digest.update(b':')
+            digest.update(encoded)
+    return digest.hexdigest()
+
+
+def write_rendered_files(rendered_files, target_dir):
+    for file_name, data, file_mode in rendered_files:
+        target_file_path = os.path.join(target_dir, file_name)
+        LOG.info("Writing template file: {}", target_file_path)
+        with open(target_file_path, 'w') as f:
+            f.write(data)
+        os.chmod(target_file_path, file_mode)
+
+
+class WorkDirCache(object):
+    """Execution work directories keyed by the hash of the rendered template content.
+
+    Identical renders reuse the existing directory as is. Directories are evicted when
+    they have not been used for max_age seconds, or when there are more than max_entries
+    of them, in which case the least recently used ones go first. Directories in use, see
+    use_work_dir, are never evicted.
+    """
+
+    def __init__(self, cache_root=DEFAULT_WORK_DIR_CACHE_ROOT,
+                 max_entries=DEFAULT_WORK_DIR_CACHE_MAX_ENTRIES,
+                 max_age=DEFAULT_WORK_DIR_CACHE_MAX_AGE):
+        self.cache_root = os.path.abspath(os.path.expanduser(cache_root))
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    def __ensure_cache_root(self):
+        try:
+            os.makedirs(self.cache_root, 0o700)
+        except OSError as err:
+            if err.errno != errno.EEXIST or not os.path.isdir(self.cache_root):
+                raise
+        self.__check_cache_root()
+
+    def __check_cache_root(self):
+        """Refuses cache roots others could have written to, as the cached work directories
+        are reused as is for execution."""
+        root_stat = os.lstat(self.cache_root)
+        if not stat.S_ISDIR(root_stat.st_mode):
+            raise ValueError("Work directory cache root is not a directory: {}"
+                             .format(self.cache_root))
+        if hasattr(os, 'getuid') and root_stat.st_uid != os.getuid():
+            raise ValueError("Work directory cache root is not owned by the current user: {}"
+                             .format(self.cache_root))
+        if root_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("Work directory cache root is writable by group or others: {}"
+                             .format(self.cache_root))
+
+    def list_entries(self):
+        """Lists (last_used_timestamp, path) of all cached work directories, oldest first."""
+        if not os.path.isdir(self.cache_root):
+            return []
+        self.__check_cache_root()
+        entries = []
+        for x in os.listdir(self.cache_root):
+            x_path = os.path.join(self.cache_root, x)
+            if x.startswith(WORK_DIR_TMP_PREFIX):
+                continue
+            try:
+                if os.path.isdir(x_path):
+                    entries.append((os.path.getmtime(x_path), x_path))
+            except OSError:
+                # Removed concurrently.
+                continue
+        return sorted(entries)
+
+    @contextlib.contextmanager
+    def use_work_dir(self, rendered_files):
+        """Yields the work directory for given rendered files, creating it if needed. The
+        directory is not evicted before the with block exits, also not by other processes."""
+        self.__ensure_cache_root()
+        work_dir = os.path.join(self.cache_root, hash_rendered_files(rendered_files))
+        lock_file = self.__lock(work_dir, fcntl.LOCK_SH)
+        try:
+            self.__create_work_dir(work_dir, rendered_files)
+            self.evict(keep=work_dir)
+            yield work_dir
+        finally:
+            lock_file.close()
+
+    def get_work_dir(self, rendered_files):
+        """Returns the work directory for given rendered files, creating it if needed. Use
+        use_work_dir instead, if the directory must stay around while it is being used."""
+        with self.use_work_dir(rendered_files) as work_dir:
+            return work_dir
+
+    def __create_work_dir(self, work_dir, rendered_files):
+        if os.path.isdir(work_dir):
+            LOG.info("Reusing cached work directory: {}", work_dir)
+            os.utime(work_dir, None)
+            return
+        # Render into a temporary directory first, so that a half written work directory
+        # is never visible under its final name.
+        tmp_dir = tempfile.mkdtemp(prefix=WORK_DIR_TMP_PREFIX, dir=self.cache_root)
+        try:
+            write_rendered_files(rendered_files, tmp_dir)
+            os.rename(tmp_dir, work_dir)
+            LOG.info("Created work directory: {}", work_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(work_dir):
+                raise
+            LOG.info("Work directory created concurrently, reusing: {}", work_dir)
+
+    @staticmethod
+    def __lock(work_dir, operation):
+        """Opens and locks the lock file of given work directory. Returns the open lock file,
+        or None if a non-blocking lock is already held by someone else."""
+        lock_path = work_dir + WORK_DIR_LOCK_SUFFIX
+        while True:
+            lock_file = open(lock_path, 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), operation)
+            except IOError as err:
+                lock_file.close()
+                if err.errno in (errno.EAGAIN, errno.EACCES):
+                    return None
+                raise
+            # The lock file is removed along with an evicted directory. Retry, if that
+            # happened after it was opened here.
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except OSError:
+                pass
+            lock_file.close()
+
+    def evict(self, max_entries=None, max_age=None, keep=None):
+        """Removes expired and least recently used work directories, except the ones in use.
+        Returns removed paths."""
+        if max_entries is None:
+            max_entries = self.max_entries
+        if max_age is None:
+            max_age = self.max_age
+        entries = [(t, path) for t, path in self.list_entries() if path != keep]
+        remaining = len(entries) + (1 if keep else 0)
+        now = time.time()
+        removed = []
+        for last_used, path in entries:
+            too_old = max_age is not None and now - last_used > max_age
+            too_many = max_entries is not None and remaining > max_entries
+            if not too_old and not too_many:
+                continue
+            lock_file = self.__lock(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if lock_file is None:
+                LOG.info("Work directory in use, not evicting: {}", path)
+                continue
+            try:
+                LOG.info("Evicting work directory: {}", path)
+                shutil.rmtree(path, ignore_errors=True)
+                os.remove(path + WORK_DIR_LOCK_SUFFIX)
+            finally:
+                lock_file.close()
+            removed.append(path)
+            remaining -= 1
+        self.__remove_stale_tmp_dirs(now)
+        return removed
+
+    def clear(self):
+        """Removes all cached work directories not in use. Returns removed paths."""
+        return self.evict(max_entries=0, max_age=0)
+
+    def __remove_stale_tmp_dirs(self, now):
+        """Removes temporary directories left behind by interrupted renders. Renders still
+        in progress are left alone, whatever the max age of the work directories is."""
+        if not os.path.isdir(self.cache_root):
+            return
+        for x in os.listdir(self.cache_root):
+            x_path = os.path.join(self.cache_root, x)
+            try:
+                if x.startswith(WORK_DIR_TMP_PREFIX) and \
+                        now - os.path.getmtime(x_path) > WORK_DIR_TMP_GRACE_PERIOD:
+                    shutil.rmtree(x_path, ignore_errors=True)
+            except OSError:
+                # Renamed into place or removed concurrently.
+                continue
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+import json
+import shutil
+import sys
+import os
+from click.testing import CliRunner
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from exconf import check, cli, config
+from testutils import make_config_root, write_file, write_yaml
+
+
+class ExconfCheckerTest(unittest.TestCase):
+    def setUp(self):
+        self.config_root = make_config_root()
+        write_file(os.path.join(self.config_root, 'environments', 'dev', 'env.yaml'),
+                   'host_name: dev.example.com\n')
+        write_file(os.path.join(self.config_root, 'templates', 'echo', 'deploy.sh'),
+                   'echo ${{ message }}\n')
+        write_file(os.path.join(self.config_root, 'templates', 'named', '___file_name___.conf'),
+                   'host: ${{ host_name }}\n')
+        services = {
+            'clean': {'template_type': 'echo', 'message': 'Hello ${{ host_name }}'},
+            'missing': {'template_type': 'echo', 'message': '${{ undefined_var }}'},
+            'loop': {'template_type': 'echo', 'message': '${{ a }}',
+                     'a': 'x ${{ b }}', 'b': 'y ${{ a }}'},
+            'bad-name': {'template_type': 'named', 'file_name': 'not/valid'},
+            'bad-type': {'template_type': 'undefined_type', 'message': 'Hello'}
+        }
+        for service, variables in services.items():
+            write_yaml(os.path.join(self.config_root, 'services', service, 'conf.yaml'),
+                       variables)
+        self.checker = check.ExconfChecker(config.ExconfConfig(self.config_root))
+
+    def tearDown(self):
+        shutil.rmtree(self.config_root, ignore_errors=True)
+
+    def issue_types(self, service):
+        return [(x['type'], x['variable']) for x in self.checker.check(service, 'dev')]
+
+    def test_clean(self):
+        self.assertEqual(self.checker.check('clean', 'dev'), [])
+
+    def test_missing_variable(self):
+        issues = self.checker.check('missing', 'dev')
+        self.assertEqual([(x['type'], x['variable'], x['source'], x['line']) for x in issues],
+                         [(check.ISSUE_MISSING_VARIABLE, 'undefined_var', 'variable:message', 1)])
+
+    def test_reference_cycle(self):
+        self.assertEqual(self.issue_types('loop'), [(check.ISSUE_REFERENCE_CYCLE, 'a')])
+        self.assertIn('a, b', self.checker.check('loop', 'dev')[0]['message'])
+
+    def test_invalid_file_name_substitute(self):
+        self.assertEqual(self.issue_types('bad-name'),
+                         [(check.ISSUE_INVALID_FILE_NAME, 'file_name')])
+
+    def test_invalid_template_type(self):
+        self.assertEqual(self.issue_types('bad-type'), [(check.ISSUE_INVALID_CONFIG, None)])
+        self.assertEqual(self.checker.check('bad-type', 'dev')[0]['source'], 'template_type')
+
+    def test_templated_templates_dir(self):
+        exconf_yaml = os.path.join(self.config_root, 'exconf.yaml')
+        with open(exconf_yaml, 'a') as f:
+            f.write("templates_dir_name: '${{ tpl }}'\ntpl: templates\n")
+        checker = check.ExconfChecker(config.ExconfConfig(self.config_root))
+        self.assertEqual(checker.check('clean', 'dev'), [])
+        with open(exconf_yaml, 'a') as f:
+            f.write("tpl: no-such-dir\n")
+        issues = check.ExconfChecker(config.ExconfConfig(self.config_root)).check('clean', 'dev')
+        self.assertEqual([(x['type'], x['source']) for x in issues],
+                         [(check.ISSUE_INVALID_CONFIG, 'templates_dir_name')])
+
+    def test_check_all(self):
+        issues = self.checker.check_all()
+        self.assertEqual(sorted(set(x['service'] for x in issues)),
+                         ['bad-name', 'bad-type', 'loop', 'missing'])
+        self.assertEqual(len(issues), 4)
+
+    def test_cli(self):
+        runner = CliRunner()
+        result = runner.invoke(cli.cli, ['-c', self.config_root, 'check', '-s', 'clean'],
+                               obj={})
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('No issues found', result.output)
+
+        result = runner.invoke(cli.cli, ['-c', self.config_root, 'check', '-j'], obj={})
+        self.assertEqual(result.exit_code, 1)
+        issues = json.loads(result.output)
+        self.assertEqual(len(issues), 4)
+        self.assertEqual(sorted(issues[0].keys()),
+                         ['environment', 'line', 'message', 'service', 'source', 'type',
+                          'variable'])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+import shutil
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from exconf import compact, config
+from testutils import make_config_root, write_yaml
+
+
+class MatrixResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.config_root = make_config_root(copy_templates=True)
+        envs_dir = os.path.join(self.config_root, 'environments')
+        write_yaml(os.path.join(envs_dir, 'globals.yaml'), {
+            'domain': 'example.com',
+            'url': 'https://${{ service }}.${{ env_domain }}',
+            'env_domain': '${{ environment }}.${{ domain }}',
+            'port': 80,
+            'log_level': 'info',
+            'plain': 'same everywhere'})
+        write_yaml(os.path.join(envs_dir, 'dev', 'env.yaml'), {'log_level': 'debug'})
+        write_yaml(os.path.join(envs_dir, 'dev', 'services', 'web', 'conf.yaml'),
+                   {'log_level': 'info'})
+        write_yaml(os.path.join(envs_dir, 'prod', 'env.yaml'), {'domain': 'example.org'})
+        write_yaml(os.path.join(envs_dir, 'prod', 'services', 'api', 'conf.yaml'),
+                   {'log_level': 'info', 'port': 8080})
+        for service in ('api', 'web'):
+            write_yaml(os.path.join(self.config_root, 'services', service, 'conf.yaml'),
+                       {'template_type': 'echo', 'message': '${{ url }} ${{ log_level }}'})
+        self.cfg = config.ExconfConfig(self.config_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_root, ignore_errors=True)
+
+    def test_equal_to_resolve_variables(self):
+        resolver = compact.MatrixResolver(self.cfg)
+        results = resolver.resolve_all()
+        self.assertEqual(len(results), 4)
+        for (service, environment), resolved in results.items():
+            expected = self.cfg.resolve_variables(service, environment)
+            self.assertEqual(resolved.to_dict(), expected)
+            self.assertEqual(len(resolved), len(expected))
+
+    def test_shares_values(self):
+        results = compact.MatrixResolver(self.cfg).resolve_all()
+        self.assertIs(results[('api', 'dev')]['plain'], results[('web', 'prod')]['plain'])
+        self.assertIs(results[('api', 'dev')]['env_domain'], results[('web', 'dev')]['env_domain'])
+        self.assertEqual(results[('api', 'prod')]['message'], 'https://api.prod.example.org info')
+
+    def test_extra_variables(self):
+        resolver = compact.MatrixResolver(self.cfg)
+        resolved = resolver.resolve('web', 'dev', {'domain': 'example.net'})
+        self.assertEqual(resolved['url'], 'https://web.dev.example.net')
+        self.assertEqual(resolver.resolve('web', 'dev')['url'], 'https://web.dev.example.com')
+
+    def test_render_context(self):
+        render_ctx = compact.MatrixResolver(self.cfg).create_render_context('api', 'prod')
+        rendered_files = render_ctx.render_template_files()
+        self.assertIn('echo https://api.prod.example.org info', rendered_files[0][1])
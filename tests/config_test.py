@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+import shutil
+import sys
+import os
+import tempfile
+import threading
+from click.testing import CliRunner
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from exconf import cli, config
+from testutils import EXAMPLE_ROOT
+
+
+class RenderContextTest(unittest.TestCase):
+    def setUp(self):
+        self.cfg = config.ExconfConfig(EXAMPLE_ROOT)
+
+    def test_render_template_files(self):
+        render_ctx = self.cfg.create_render_context('hello-world', 'local')
+        rendered_files = render_ctx.render_template_files()
+        self.assertEqual([(name, mode) for name, _, mode in rendered_files],
+                         [('deploy.sh', 0o770)])
+        self.assertIn('In environment \\"local\\", with host \\"localhost\\"', rendered_files[0][1])
+        self.assertEqual(render_ctx.get_execution_command(), './deploy.sh')
+
+    def test_contexts_do_not_share_state(self):
+        first = self.cfg.create_render_context('hello-world', 'local', {'host_name': 'first'})
+        second = self.cfg.create_render_context('hello-world', 'local', {'host_name': 'second'})
+        self.assertIn('host \\"first\\"', first.render_template_files()[0][1])
+        self.assertIn('host \\"second\\"', second.render_template_files()[0][1])
+
+    def test_resolved_vars_read_only(self):
+        render_ctx = self.cfg.create_render_context('hello-world', 'local')
+        with self.assertRaises(TypeError):
+            render_ctx.resolved_vars['host_name'] = 'changed'
+
+    def test_work_dir_cache_settings_from_exconf_yaml_only(self):
+        render_ctx = self.cfg.create_render_context('hello-world', 'local',
+                                                    {'work_dir_cache_max_entries': '1'})
+        with self.assertRaises(ValueError):
+            render_ctx.prepare_work_dir()
+
+    def test_concurrent_renders(self):
+        results = {}
+
+        def render(host_name):
+            for _ in range(20):
+                render_ctx = self.cfg.create_render_context('hello-world', 'local',
+                                                            {'host_name': host_name})
+                results.setdefault(host_name, set()).add(render_ctx.render_template_files()[0][1])
+
+        threads = [threading.Thread(target=render, args=('host{}'.format(i),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for host_name, rendered in results.items():
+            self.assertEqual(len(rendered), 1)
+            self.assertIn('host \\"{}\\"'.format(host_name), rendered.pop())
+
+    def test_resolve_variables_with_concurrent_renders(self):
+        errors = []
+        # Would break the directory lookups of the other renders, if stored into the config.
+        overrides = {'services_dir_name': 'missing', 'environments_dir_name': 'missing',
+                     'templates_dir_name': 'missing'}
+
+        def resolve():
+            try:
+                for _ in range(50):
+                    resolved = self.cfg.resolve_variables('hello-world', 'local', overrides)
+                    self.assertEqual(resolved['services_dir_name'], 'missing')
+            except Exception as err:
+                errors.append(err)
+
+        def render():
+            try:
+                for _ in range(20):
+                    render_ctx = self.cfg.create_render_context('hello-world', 'local')
+                    self.assertEqual(render_ctx.render_template_files()[0][0], 'deploy.sh')
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=resolve)]
+        threads.extend(threading.Thread(target=render) for _ in range(4))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.cfg.list_services(), ['hello-world'])
+
+
+class TemplateCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.config_root = os.path.join(tempfile.mkdtemp(), 'example')
+        shutil.copytree(EXAMPLE_ROOT, self.config_root)
+        with open(os.path.join(self.config_root, 'environments', 'globals.yaml'), 'a') as f:
+            f.write("unused: '${{ nope }}'\n")
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.config_root), ignore_errors=True)
+
+    def test_unused_missing_variable(self):
+        result = CliRunner().invoke(cli.cli, ['-c', self.config_root, 'template',
+                                              '-s', 'hello-world', '-e', 'local'], obj={})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('host \\"localhost\\"', result.output)
+
+    def test_missing_variable_in_template(self):
+        with open(os.path.join(self.config_root, 'templates', 'echo', 'deploy.sh'), 'a') as f:
+            f.write('echo ${{ nope }}\n')
+        args = ['-c', self.config_root, 'template', '-s', 'hello-world', '-e', 'local']
+        self.assertIsInstance(CliRunner().invoke(cli.cli, args, obj={}).exception, KeyError)
+        result = CliRunner().invoke(cli.cli, args + ['-i'], obj={})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('echo ${{ nope }}', result.output)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by the tests and the benchmarks."""
+import os
+import shutil
+import tempfile
+import yaml
+
+EXAMPLE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'example'))
+
+
+def write_file(file_path, data):
+    if not os.path.isdir(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path))
+    with open(file_path, 'w') as f:
+        f.write(data)
+
+
+def write_yaml(file_path, data):
+    write_file(file_path, yaml.dump(data, default_flow_style=False))
+
+
+def make_config_root(copy_templates=False):
+    """Creates a temporary configuration root with the example exconf.yaml, and optionally
+    the example templates. The caller removes it."""
+    config_root = tempfile.mkdtemp()
+    shutil.copy(os.path.join(EXAMPLE_ROOT, 'exconf.yaml'), config_root)
+    if copy_templates:
+        shutil.copytree(os.path.join(EXAMPLE_ROOT, 'templates'),
+                        os.path.join(config_root, 'templates'))
+    return config_root
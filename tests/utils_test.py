@@ -57,3 +57,24 @@ class UtilsTest(unittest.TestCase):
         with self.assertRaises(yaml.scanner.ScannerError) as context:
             utils.read_yaml("./tests/resources/invalid.yaml")
             self.assertTrue("Oops! File ./tests/resources/invalid.yaml is not a valid yaml." in context)
+
+    def test_find_template_vars(self):
+        data = "a ${{ foo }} b ${{bar}}\n# ${{ commented }}\n${{ foo }} ${{ unclosed"
+        self.assertEqual(utils.find_template_vars(data, '#', '${{', '}}'),
+                         [(1, 'foo'), (1, 'bar'), (3, 'foo')])
+        self.assertEqual(utils.find_template_vars(data, '', '${{', '}}'),
+                         [(1, 'foo'), (1, 'bar'), (2, 'commented'), (3, 'foo')])
+        self.assertEqual(utils.find_template_vars('x ${{}} y ${{ foo }}', '#', '${{', '}}'),
+                         [(1, 'foo')])
+
+    def test_find_filename_vars(self):
+        self.assertEqual(utils.find_filename_vars('___service___-___env___.yml'),
+                         ['service', 'env'])
+        self.assertEqual(utils.find_filename_vars('plain.yml'), [])
+        self.assertEqual(utils.find_filename_vars('___unclosed.yml'), [])
+
+    def test_find_reference_cycles(self):
+        references = {'a': {'b'}, 'b': {'c'}, 'c': {'a'}, 'd': {'a'}, 'e': {'e'}, 'f': set()}
+        self.assertEqual(sorted(utils.find_reference_cycles(references)),
+                         [['a', 'b', 'c'], ['e']])
+        self.assertEqual(utils.find_reference_cycles({'a': {'b'}, 'b': set()}), [])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+import shutil
+import sys
+import os
+import tempfile
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from exconf import workdir
+
+RENDERED_FILES = [('deploy.sh', 'echo hello\n', 0o770), ('conf.yml', 'foo: bar\n', 0o640)]
+
+
+class WorkDirCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_root = os.path.join(tempfile.mkdtemp(), 'cache')
+        self.cache = workdir.WorkDirCache(self.cache_root, max_entries=2, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.cache_root), ignore_errors=True)
+
+    def test_hash_independent_of_order(self):
+        self.assertEqual(workdir.hash_rendered_files(RENDERED_FILES),
+                         workdir.hash_rendered_files(list(reversed(RENDERED_FILES))))
+        self.assertNotEqual(workdir.hash_rendered_files(RENDERED_FILES),
+                            workdir.hash_rendered_files(RENDERED_FILES[:1]))
+
+    def test_get_work_dir_writes_files(self):
+        work_dir = self.cache.get_work_dir(RENDERED_FILES)
+        self.assertEqual(sorted(os.listdir(work_dir)), ['conf.yml', 'deploy.sh'])
+        self.assertEqual(open(os.path.join(work_dir, 'deploy.sh')).read(), 'echo hello\n')
+        self.assertEqual(os.stat(os.path.join(work_dir, 'deploy.sh')).st_mode & 0o777, 0o770)
+        self.assertEqual(os.stat(work_dir).st_mode & 0o077, 0)
+        self.assertEqual(os.stat(self.cache_root).st_mode & 0o077, 0)
+
+    def test_hash_bytes(self):
+        self.assertEqual(workdir.hash_rendered_files([('a', u'# caf\xe9', 0o640)]),
+                         workdir.hash_rendered_files([('a', u'# caf\xe9'.encode('utf-8'), 0o640)]))
+
+    def test_refuse_writable_cache_root(self):
+        os.makedirs(self.cache_root)
+        os.chmod(self.cache_root, 0o777)
+        with self.assertRaises(ValueError):
+            self.cache.get_work_dir(RENDERED_FILES)
+        with self.assertRaises(ValueError):
+            self.cache.evict()
+
+    def test_identical_render_reuses_work_dir(self):
+        work_dir = self.cache.get_work_dir(RENDERED_FILES)
+        marker = os.path.join(work_dir, 'marker')
+        open(marker, 'w').write('')
+        self.assertEqual(self.cache.get_work_dir(list(reversed(RENDERED_FILES))), work_dir)
+        self.assertTrue(os.path.exists(marker))
+        self.assertEqual(len(self.cache.list_entries()), 1)
+
+    def test_evict_least_recently_used(self):
+        first = self.cache.get_work_dir([('a', '1', 0o640)])
+        os.utime(first, (time.time() - 10, time.time() - 10))
+        second = self.cache.get_work_dir([('a', '2', 0o640)])
+        third = self.cache.get_work_dir([('a', '3', 0o640)])
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual([path for _, path in self.cache.list_entries()], [second, third])
+
+    def test_evict_too_old(self):
+        work_dir = self.cache.get_work_dir(RENDERED_FILES)
+        os.utime(work_dir, (time.time() - 7200, time.time() - 7200))
+        self.assertEqual(self.cache.evict(), [work_dir])
+        self.assertEqual(self.cache.list_entries(), [])
+
+    def test_clear(self):
+        self.cache.get_work_dir([('a', '1', 0o640)])
+        self.cache.get_work_dir([('a', '2', 0o640)])
+        in_progress = tempfile.mkdtemp(prefix=workdir.WORK_DIR_TMP_PREFIX, dir=self.cache_root)
+        self.assertEqual(len(self.cache.clear()), 2)
+        self.assertEqual(self.cache.list_entries(), [])
+        self.assertTrue(os.path.isdir(in_progress))
+
+    def test_evict_stale_tmp_dirs(self):
+        os.makedirs(self.cache_root, 0o700)
+        stale = tempfile.mkdtemp(prefix=workdir.WORK_DIR_TMP_PREFIX, dir=self.cache_root)
+        stale_time = time.time() - workdir.WORK_DIR_TMP_GRACE_PERIOD - 1
+        os.utime(stale, (stale_time, stale_time))
+        self.cache.evict()
+        self.assertFalse(os.path.exists(stale))
+
+    def test_work_dir_in_use_not_evicted(self):
+        with self.cache.use_work_dir(RENDERED_FILES) as work_dir:
+            other_cache = workdir.WorkDirCache(self.cache_root)
+            self.assertEqual(other_cache.clear(), [])
+            self.assertEqual(self.cache.evict(max_age=0), [])
+            self.assertTrue(os.path.isdir(work_dir))
+        self.assertEqual(self.cache.clear(), [work_dir])
+        self.assertEqual(os.listdir(self.cache_root), [])
+
+    def test_entries_removed_concurrently(self):
+        self.cache.get_work_dir(RENDERED_FILES)
+        getmtime = os.path.getmtime
+
+        def vanished(path):
+            raise OSError(2, 'No such file or directory', path)
+        os.path.getmtime = vanished
+        try:
+            self.assertEqual(self.cache.list_entries(), [])
+            self.assertEqual(self.cache.evict(), [])
+        finally:
+            os.path.getmtime = getmtime